@@ -15,6 +15,7 @@ Tested on:
 import os
 import sys
 import concurrent.futures
+import multiprocessing.util
 from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path  # Python 3.4
 import time
@@ -22,27 +23,46 @@ from datetime import datetime
 import random
 import configparser
 import collections
+import contextlib
+import itertools
+import functools
 import argparse
 import json
 import chess.pgn
 import chess.engine
 import logging
+import logging.handlers
 
 
 APP_NAME = 'combat'
 APP_VERSION = 'v1.28'
 
 
-# Increase limit to fix RecursionError
+# Increase limit to fix RecursionError, python-chess exports the moves of a
+# pgn game to text recursively.
 sys.setrecursionlimit(10000)  
 
 
-# Save created loggers to be used later when creating other loggers, making
-# sure that logger has no duplicates to avoid double entries in the logs.
-saved_loggers = {}
+# Engines started by this process by player index, they are reused for the
+# next games instead of starting new engine processes for every game.
+saved_engines = {}
+
+# Match settings that are the same for all games, set once per worker
+# process by init_worker() instead of being sent with every game.
+match_settings = {}
+
+# Result of a game returned by Match.start_match(), the game is returned
+# as pgn text and a dict of its headers, the players by their index in
+# player_data.
+MatchResult = collections.namedtuple(
+    'MatchResult',
+    'pgn headers game_num round_number game_elapse white_index black_index')
         
 
 class Timer():
+    # The clock of the side to move is read and updated every move.
+    __slots__ = ('btms', 'itms', 'rem_time', 'tf', 'tc')
+    
     def __init__(self, btms, itms):
         """ 
         btms: base time in ms
@@ -53,23 +73,44 @@ class Timer():
         self.rem_time = btms
         self.tf = False  # tf is time forfeit
         
-    def update_time(self, elapse, log_fn):
+        # Time control for pgn header, formatted once per player.
+        self.tc = f'{get_time_h_mm_ss_ms(btms)} + {get_time_h_mm_ss_ms(itms, True)}'
+        
+    def update_time(self, elapse, logger):
         """ 
-        elapse: time in ms spent on a search
+        elapse: time in ms spent on a search, an int
+        logger: logger used to report time troubles
         """  
-        logger = setup_logging('update_time', log_fn)
-        if self.rem_time - int(elapse) < 1:
+        if self.rem_time - elapse < 1:
             logger.warning('Remaining time is below 1ms before adding the increment!')
             self.tf = True
         
-        self.rem_time += self.itms - int(elapse)
+        self.rem_time += self.itms - elapse
+        
+    def reset(self):
+        """ 
+        Sets the clock back to the base time for a new game, the same
+        Timer is used for all the games of a player in a worker.
+        """
+        self.rem_time = self.btms
+        self.tf = False
 
 
-class Match():    
-    def __init__(self, start_game, player1, player2,
+class Match():
+    # The match attributes are read every move in start_match.
+    __slots__ = ('start_board', 'eng_index', 'eng_files', 'eng_opts',
+                 'eng_names', 'clock',
+                 'round_num', 'total_games', 'time_forfeit',
+                 'write_time_forfeit_result', 'game_id', 'log_fn',
+                 'adjudication', 'win_score_cp', 'win_score_count',
+                 'is_engine_log', 'search_logger', 'adj_logger',
+                 'good_streak', 'bad_streak')
+
+    def __init__(self, start_board, player1, player2,
                  round_num, total_games, game_id, log_fn, adjudication=False,
                  win_score_cp=700, win_score_count=4, is_engine_log=False):
-        self.start_game = start_game
+        self.start_board = start_board
+        self.eng_index = [player1['index'], player2['index']]
         self.eng_files = [player1['file'], player2['file']]
         self.eng_opts = [player1['opt'], player2['opt']]
         self.eng_names = [player1['name'], player2['name']]
@@ -84,20 +125,19 @@ class Match():
         self.win_score_cp = win_score_cp
         self.win_score_count = win_score_count
         self.is_engine_log = is_engine_log
+        self.search_logger = None  # Set in start_match
+        self.adj_logger = None  # Set in start_match
+        self.good_streak = [0, 0]  # [black, white]
+        self.bad_streak = [0, 0]
 
-    def update_headers(self, game, board, wplayer, bplayer, score_adjudication, elapse):
-        ga = chess.pgn.Game()
-        g = ga.from_board(board)
-        
+    def update_headers(self, game, board, wplayer, bplayer, score_adjudication,
+                       termination, elapse):
+        # The FEN and SetUp headers of the start position were already set
+        # when game was created from the start board.
         game.headers['Event'] = 'Computer games'
         game.headers['Site'] = 'Combat'
         game.headers['Date'] = datetime.today().strftime('%Y.%m.%d')
         
-        try:
-            game.headers['FEN'] = g.headers['FEN']    
-        except:
-            pass
-        
         if self.time_forfeit[1] or self.time_forfeit[0]:
             game.headers['Termination'] = 'time forfeit'
             
@@ -117,305 +157,433 @@ class Match():
             
             game.headers['Result'] = '1-0' if score_adjudication[1] else '0-1'            
         
+        # Game over by the rules, termination was found by the move loop.
         else:
-            game.headers['Result'] = g.headers['Result']
-            
-            if board.is_checkmate():
-                game.headers['Termination'] = 'checkmate'
-                
-            elif board.is_stalemate():
-                game.headers['Termination'] = 'stalemate'
-                
-            elif board.is_insufficient_material():
-                game.headers['Termination'] = 'insufficient mating material'
-                
-            elif board.can_claim_fifty_moves():
-                game.headers['Termination'] = 'fifty-move draw rule' 
-                
-            elif board.is_repetition(count=3):
-                game.headers['Termination'] = 'threefold repetition'
-                
+            if termination == 'checkmate':
+                game.headers['Result'] = '0-1' if board.turn == chess.WHITE else '1-0'
             else:
-                # Todo: Check the game if this is triggered, not encountered so far.
-                game.headers['Termination'] = 'unknown'
+                game.headers['Result'] = '1/2-1/2'
+            game.headers['Termination'] = termination
         
         game.headers['Round'] = self.round_num
         game.headers['White'] = wplayer
         game.headers['Black'] = bplayer
         
-        game.headers['WhiteTimeControl'] = \
-            f'{get_time_h_mm_ss_ms(self.clock[1].btms*1000000)} + {get_time_h_mm_ss_ms(self.clock[1].itms*1000000, True)}'
-        game.headers['BlackTimeControl'] = \
-            f'{get_time_h_mm_ss_ms(self.clock[0].btms*1000000)} + {get_time_h_mm_ss_ms(self.clock[0].itms*1000000, True)}'
+        game.headers['WhiteTimeControl'] = self.clock[1].tc
+        game.headers['BlackTimeControl'] = self.clock[0].tc
             
         game.headers['GameDuration'] = get_time_h_mm_ss_ms(elapse)
 
         return game
     
-    def get_search_info(self, result, info):
-        logger = setup_logging('search_info', self.log_fn)
-        if info == 'score':
-            score = None
-            try:
-                score = result.info[info].relative.score(mate_score=32000)
-            except KeyError as e:
-                logger.warning(e)
-            except Exception:
-                logger.exception(f'Exception in getting {info} from search info.')
-                logger.debug(result)
-                
-            return score
-        
-        elif info == 'depth':
-            depth = None
-            try:
-                depth = result.info[info]
-            except KeyError as e:
-                logger.warning(e)
-            except Exception:
-                logger.exception(f'Exception in getting {info} from search info.')
-                logger.exception(result)
-                
-            return depth
+    def get_search_info(self, result):
+        """
+        Extract the search info needed for the move comments in one pass.
         
-        elif info == 'time':
-            time = None
-            try:
-                time = result.info[info] * 1000
-            except KeyError as e:
-                logger.warning(e)
-            except Exception:
-                logger.exception(f'Exception in getting {info} from search info.')
-                logger.debug(result)
-                
-            return time
+        result: engine play result
+        Return: (score_cp, depth, time_ms, nodes), None for missing items
+        """
+        logger = self.search_logger
+        info = result.info
         
-        elif info == 'nodes':
-            nodes = None
+        score = info.get('score')
+        if score is not None:
             try:
-                nodes = result.info[info]
-            except KeyError as e:
-                logger.warning(e)
+                score = score.relative.score(mate_score=32000)
             except Exception:
-                logger.exception(f'Exception in getting {info} from search info.')
+                logger.exception('Exception in getting score from search info.')
                 logger.debug(result)
+                score = None
                 
-            return nodes
+        depth = info.get('depth')
+        time_ms = info.get('time')
+        if time_ms is not None:
+            time_ms = round(time_ms * 1000)
+        nodes = info.get('nodes')
+            
+        if score is None or depth is None or time_ms is None:
+            missing = [k for k, v in (('score', score), ('depth', depth),
+                                      ('time', time_ms)) if v is None]
+            logger.warning(f'Missing search info: {", ".join(missing)}')
+            
+        return score, depth, time_ms, nodes
+    
+    def update_score_streak(self, side, score):
+        """
+        Update the number of successive winning and losing scores of side.
         
-        return None
+        side: chess.WHITE or chess.BLACK
+        score: engine score in cp from the point of view of side
+        """
+        w = self.win_score_cp  # Default 700
+        self.good_streak[side] = self.good_streak[side] + 1 if score >= w else 0
+        self.bad_streak[side] = self.bad_streak[side] + 1 if score <= -w else 0
     
-    def win_score_adjudication(self, wscores, bscores):
+    def win_score_adjudication(self):
         """
         Adjudicate game by score, scores of one side should be successively
         winning and the scores of other side are successively losing.
         
-        wscores: a list of white scores
-        bscores: a list of black scores
+        The streaks are maintained by update_score_streak, so this only
+        compares counters instead of scanning the last n scores.
         
         Return: 
             [True, False] if game is good for black
             [False, True] if game is good for white
             [False, False] if game is not to be adjudicated
         """
-        logger = setup_logging('adjudication', self.log_fn)
+        logger = self.adj_logger
         
         n = self.win_score_count  # Default 4
-        w = self.win_score_cp  # Default 700
-        ret = [False, False]  # [Black, white]
-        
-        if len(wscores) < n or len(bscores) < n:
-            return ret
+        good, bad = self.good_streak, self.bad_streak
         
         # (1) White wins
-        w_good_cnt, b_bad_cnt = 0, 0
-        for s in wscores[-n:]:  # Check the last n scores
-            if s >= w:
-                w_good_cnt += 1
-                
-        for s in bscores[-n:]:
-            if s <= -w:
-                b_bad_cnt += 1
-                
-        if w_good_cnt >= n and b_bad_cnt >= n:
-            logger.debug(f'White wins by adjudication. White last {n} scores: {wscores[-n:]}, Black last {n} scores: {bscores[-n:]}')
+        if good[chess.WHITE] >= n and bad[chess.BLACK] >= n:
+            logger.debug(f'White wins by adjudication. White last {good[chess.WHITE]} scores are winning, Black last {bad[chess.BLACK]} scores are losing.')
             return [False, True]
         
         # (2) Black wins
-        w_bad_cnt, b_good_cnt = 0, 0
-        for s in bscores[-n:]:
-            if s >= w:
-                b_good_cnt += 1
-                
-        for s in wscores[-n:]:
-            if s <= -w:
-                w_bad_cnt += 1
-                
-        if b_good_cnt >= n and w_bad_cnt >= n:
-            logger.debug(f'Black wins by adjudication. Black last {n} scores: {bscores[-n:]}, White last {n} scores: {wscores[-n:]}')
+        if good[chess.BLACK] >= n and bad[chess.WHITE] >= n:
+            logger.debug(f'Black wins by adjudication. Black last {good[chess.BLACK]} scores are winning, White last {bad[chess.WHITE]} scores are losing.')
             return [True, False]
         
-        return ret
+        return [False, False]
     
     def start_match(self):
+        # Loggers are looked up once per game here rather than in the move
+        # loop. This runs in the worker process, so the handlers are created
+        # on the side that actually writes the logs.
         logger = setup_logging('Match.start_match', self.log_fn)
+        self.search_logger = setup_logging('search_info', self.log_fn)
+        self.adj_logger = setup_logging('adjudication', self.log_fn)
+        time_logger = setup_logging('update_time', self.log_fn)
         
         # Enable python-chess module engine logger, saved in a different file.
         if self.is_engine_log:
             setup_logging('chess.engine', 'engine_log.txt')
         
-        # Save score info per move from both engines for score adjudications
-        eng_score = {0: [], 1: []}
+        # Count successive winning/losing scores per side for score adjudication
+        self.good_streak, self.bad_streak = [0, 0], [0, 0]
         score_adjudication = [False, False]
         
-        eng = [chess.engine.SimpleEngine.popen_uci(self.eng_files[0]),
-                chess.engine.SimpleEngine.popen_uci(self.eng_files[1])]
+        # Quit the engines of players that are not in this game, a worker
+        # runs at most the two engines of the game it plays.
+        quit_engines(keep=self.eng_index)
         
-        # Set options
-        for k, v in self.eng_opts[0].items():
-            eng[0].configure({k: v})
-        for k, v in self.eng_opts[1].items():
-            eng[1].configure({k: v})           
+        eng = [get_engine(self.eng_index[0], self.eng_files[0], self.eng_opts[0]),
+               get_engine(self.eng_index[1], self.eng_files[1], self.eng_opts[1])]
         
-        # Create a board which will be played by engines.        
-        end_node = self.start_game.end()
-        end_board = end_node.board()
+        # Create a board which will be played by engines. Keep the copy, all
+        # the matches of a worker with this opening share its start board.
+        end_board = self.start_board
         board = end_board.copy()
         logger.debug(f'Create board from fen: {board.fen()}')
         
-        # Create a game for annotated game output.
-        game = chess.pgn.Game()
-        game = game.from_board(end_board)
-        node = game.end()
+        # Moves played and their comments, the annotated game output is
+        # built from these once the game is over.
+        moves, comments = [], []
 
         logger.info(f'Starting, game: {self.game_id} / {self.total_games}, round: {self.round_num}, players: {self.eng_names[1]} vs {self.eng_names[0]}')
         
         # First engine with index 0 will handle the black side.
-        self.clock[1].rem_time = self.clock[1].btms
-        self.clock[0].rem_time = self.clock[0].btms
+        self.clock[1].reset()
+        self.clock[0].reset()
+        
+        # Increments are constant during the game, convert them to seconds
+        # for chess.engine.Limit only once.
+        wclock, bclock = self.clock[1], self.clock[0]
+        winc_s, binc_s = wclock.itms/1000, bclock.itms/1000
+        adj = self.adjudication
         
-        game_start = time.perf_counter_ns()
+        game_start = get_time_ms()
         
         # Play the game, till its over by python-chess
-        while not board.is_game_over():
+        while True:
+            termination = get_termination(board)
+            if termination is not None:
+                break
+            
+            # Side to move and its clock, the same until the move is pushed.
+            turn = board.turn
+            clk = self.clock[turn]
+            
             # Get init time in case the engine does not send its time info.
-            t1 = time.perf_counter_ns()
+            t1 = get_time_ms()
             
             # Let engine search for the best move of the given board.
-            result = eng[board.turn].play(board, chess.engine.Limit(
-                white_clock=self.clock[1].rem_time/1000,
-                black_clock=self.clock[0].rem_time/1000,
-                white_inc=self.clock[1].itms/1000,
-                black_inc=self.clock[0].itms/1000),
+            result = eng[turn].play(board, chess.engine.Limit(
+                white_clock=wclock.rem_time/1000,
+                black_clock=bclock.rem_time/1000,
+                white_inc=winc_s,
+                black_inc=binc_s),
+                game=self.game_id,  # ucinewgame is sent when this changes
                 info=chess.engine.INFO_SCORE)
             
             # Get score, depth and time for move comments in pgn output.
-            score_cp = self.get_search_info(result, 'score')
-            depth = self.get_search_info(result, 'depth')
-            time_ms = self.get_search_info(result, 'time')
+            score_cp, depth, time_ms, _ = self.get_search_info(result)
             
             # Save score for game adjudication based on engine score
-            eng_score[board.turn].append(0 if score_cp is None else score_cp)
+            if adj:
+                self.update_score_streak(turn, 0 if score_cp is None else score_cp)
             
             # If engine does not give time spent, calculate elapse time manually.
             if time_ms is None:
-                time_ms = (time.perf_counter_ns() - t1)//1000//1000  # from nano to ms
+                time_ms = get_time_ms() - t1
             time_ms = max(1, time_ms)  # If engine sent time below 1, use a minimum of 1ms
                 
             # Update time and determine if engine exceeds allocated time.
-            self.clock[board.turn].update_time(time_ms, self.log_fn)
-            self.time_forfeit[board.turn] = self.clock[board.turn].tf
+            clk.update_time(time_ms, time_logger)
+            self.time_forfeit[turn] = clk.tf
             
-            # Save move and comment in pgn output file.               
-            node = node.add_variation(result.move)
+            # Save move and comment for the pgn output file.
+            moves.append(result.move)
             if score_cp is not None and depth is not None and time_ms is not None:
-                node.comment = f'{score_cp/100:+0.2f}/{depth} {time_ms:0.0f}ms'
+                comments.append(f'{score_cp/100:+0.2f}/{depth} {time_ms:0.0f}ms')
+            else:
+                comments.append('')
 
             # Stop the game if time limit is exceeded.
-            if self.clock[board.turn].tf:
-                logger.info(f'round: {self.round_num}, infraction: {"white" if board.turn else "black"} loses on time!')
+            if clk.tf:
+                logger.info(f'round: {self.round_num}, infraction: {"white" if turn else "black"} loses on time!')
                 break
             
             # Update the board with the move for next player
             board.push(result.move) 
             
             # Stop game by score adjudication
-            if self.adjudication:
-                score_adjudication = self.win_score_adjudication(
-                    eng_score[chess.WHITE], eng_score[chess.BLACK])
-            
-            if score_adjudication[0] or score_adjudication[1]:
-                break                    
+            if adj:
+                score_adjudication = self.win_score_adjudication()
+                if score_adjudication[0] or score_adjudication[1]:
+                    break                    
         
-        eng[0].quit()
-        eng[1].quit()
+        elapse = get_time_ms() - game_start        
         
-        elapse = time.perf_counter_ns() - game_start        
+        # Create a game for annotated game output.
+        game = chess.pgn.Game.from_board(end_board)
+        node = game.end()
+        for move, comment in zip(moves, comments):
+            node = node.add_variation(move, comment=comment)
+            
         game = self.update_headers(game, board, self.eng_names[1],
                                    self.eng_names[0], score_adjudication,
-                                   elapse)
+                                   termination, elapse)
         
-        return [game, self.game_id, self.round_num, elapse]
+        # Export the game here in the worker, main only writes the text and
+        # reads the headers. Same format as str(game), moves are not wrapped.
+        pgn = game.accept(chess.pgn.StringExporter(columns=None))
+        
+        return MatchResult(pgn, dict(game.headers), self.game_id,
+                           self.round_num, elapse, self.eng_index[1],
+                           self.eng_index[0])
+    
+    
+def init_worker(games, player_data, total_games, log_fn, adjudication,
+                win_score_cp, win_score_count, is_engine_log):
+    """
+    Saves the match settings and the start positions in this worker
+    process, run once when the worker is started.
+    """
+    match_settings.update(
+        games=games, player_data=player_data, total_games=total_games,
+        log_fn=log_fn,
+        adjudication=adjudication, win_score_cp=win_score_cp,
+        win_score_count=win_score_count, is_engine_log=is_engine_log)
+    
+    # Quit the engines of this process when it exits.
+    multiprocessing.util.Finalize(None, quit_engines, exitpriority=10)
+    
+    
+def run_matches(jobs):
+    """
+    Play the given games one after the other in the same worker.
+    
+    jobs: a list of (opening, player1, player2, round_num, game_id), opening
+        is an index in games and player1 and player2 are indexes in
+        player_data of init_worker().
+    return: a list of start_match results of the games that were played
+    """
+    games = match_settings['games']
+    pd = match_settings['player_data']
+    log_fn = match_settings['log_fn']
+    
+    results = []
+    for opening, player1, player2, round_num, game_id in jobs:
+        m = Match(games[opening], pd[player1], pd[player2], round_num,
+                  match_settings['total_games'], game_id, log_fn,
+                  match_settings['adjudication'],
+                  match_settings['win_score_cp'],
+                  match_settings['win_score_count'],
+                  match_settings['is_engine_log'])
+        try:
+            results.append(m.start_match())
+        except Exception:
+            logger = setup_logging('run_matches', log_fn)
+            logger.exception(f'Exception in game {m.game_id}, round {m.round_num}.')
+            
+            # The engines may be in a bad state, start new ones next game.
+            quit_engines()
+            
+    return results
+
+
+def get_engine(index, path_file, opt):
+    """
+    Returns the running engine of player index, starting it and setting its
+    options if it is not running yet in this process. Players with the same
+    config name still get an engine each.
+    """
+    if index in saved_engines:
+        return saved_engines[index]
+    
+    eng = chess.engine.SimpleEngine.popen_uci(path_file)
+    
+    # Set options
+    eng.configure(opt)
+        
+    saved_engines[index] = eng
+    
+    return eng
+
+
+def quit_engines(keep=()):
+    """
+    Quit the engines started by this process.
+    
+    keep: player indexes whose engines are left running
+    """
+    for index in [i for i in saved_engines if i not in keep]:
+        try:
+            saved_engines.pop(index).quit()
+        except Exception:
+            pass
     
     
 def setup_logging(name, log_fn='combat_log.txt'):
     """
-    Creates logger by name, all logs will be written to log file
+    Returns logger by name, all logs will be written to log file
     combat_log.txt, depending on the logging level.
     
+    The logger is created only once, later calls return the same logger
+    to avoid double log entries.
+    """
+    return create_logger(name, log_fn)
+
+
+@functools.lru_cache(maxsize=None)
+def create_logger(name, log_fn):
+    """
+    Creates logger by name with its console and file handlers.
+    
     At the current setting below the following will be followed:
     * Logging debug levels will be written only to log file.
     * Logging info levels and above will be written to console and log file.
     """
-    global saved_loggers
-    
     # Use logging.WARNING to disable most logging into the log file.
     # Todo: Make this available via command line options.
     combat_file_log_level = logging.DEBUG
     
-    # Do not create the same logger, to avoid double log entries    
-    if saved_loggers.get(name):
-        return saved_loggers.get(name)
-    
     logger = logging.getLogger(name)    
     logger.setLevel(logging.DEBUG)
     
-    # Create file handler to write logs to a file
-    fh = logging.FileHandler(filename=log_fn, mode='a')
-    
+    # Get the buffered handler that writes logs to a file
     if name == 'chess.engine':
-        fh.setLevel(logging.DEBUG)
+        fh = get_file_handler(log_fn, logging.DEBUG)
     else:
-        fh.setLevel(combat_file_log_level)
+        fh = get_file_handler(log_fn, combat_file_log_level)
     
     # Create console handler for console logging
     ch = logging.StreamHandler(sys.stdout)
     ch.setLevel(logging.INFO)
     
-    # Create formatter and add it to the handlers
-    fh_formatter = logging.Formatter('%(asctime)s - %(name)17s - %(levelname)8s - %(message)s')
+    # Create formatter and add it to the handler
     ch_formatter = logging.Formatter('%(message)s')
-    
-    # Set formats for each handler
-    fh.setFormatter(fh_formatter)
     ch.setFormatter(ch_formatter)
     
     # Add handlers to logger
     logger.addHandler(ch)
     logger.addHandler(fh)
     
-    saved_loggers[name] = logger
-    
     return logger
 
 
-def get_time_h_mm_ss_ms(time_ns, mmssms = False):
+@functools.lru_cache(maxsize=None)
+def get_file_handler(log_fn, level):
+    """
+    Returns the file handler of log_fn shared by the loggers of this level.
+    
+    Records are buffered and written to the file in batches, or right away
+    for errors, instead of one write for every record during the games.
+    """
+    fh = logging.FileHandler(filename=log_fn, mode='a')
+    fh_formatter = logging.Formatter('%(asctime)s - %(name)17s - %(levelname)8s - %(message)s')
+    fh.setFormatter(fh_formatter)
+    
+    mh = logging.handlers.MemoryHandler(1024, flushLevel=logging.ERROR, target=fh)
+    mh.setLevel(level)
+    
+    reset_file_handler(mh)
+    multiprocessing.util.register_after_fork(mh, reset_file_handler)
+    
+    return mh
+
+
+def reset_file_handler(mh):
+    """
+    Drops the records buffered by the parent process, these are written
+    by the parent, and writes the remaining records when the process exits.
+    
+    mh: the buffered file handler from get_file_handler()
+    """
+    mh.buffer.clear()
+    
+    # Run after quit_engines() so the engine logs are not lost.
+    multiprocessing.util.Finalize(None, mh.flush, exitpriority=0)
+
+
+def get_termination(board):
+    """
+    Get the reason of the game end, with the same checks as
+    board.is_game_over() but without probing the board again to name it.
+    
+    board: python-chess board
+    return: termination header value or None if the game is not over
+    """
+    if not any(board.generate_legal_moves()):
+        return 'checkmate' if board.is_check() else 'stalemate'
+    
+    if board.is_insufficient_material():
+        return 'insufficient mating material'
+    
+    # Seventy-five move rule, there are legal moves at this point.
+    if board.halfmove_clock >= 150:
+        return 'fifty-move draw rule'
+    
+    # Five-fold repetition, a position can only be repeated 4 times after
+    # at least 16 plies without a capture or pawn move.
+    # A fifty-move claim is named before the repetition, legal moves exist
+    # at this point so halfmove_clock alone tells if it can be claimed.
+    if board.halfmove_clock >= 16 and board.is_fivefold_repetition():
+        if board.halfmove_clock >= 100:
+            return 'fifty-move draw rule'
+        return 'threefold repetition'
+    
+    return None
+
+
+def get_time_ms():
+    """
+    Returns the performance counter time in integer ms, for time deltas.
+    """
+    return time.perf_counter_ns() // 1000000
+
+
+def get_time_h_mm_ss_ms(time_ms, mmssms = False):
         """
         Converts time delta to hh:mm:ss:ms format.
         
-        time_ns: time delta in nanoseconds
+        time_ms: time delta in ms
         return: time in h:m:s:ms format
         """
-        time_ms = time_ns//1000000
         s, ms = divmod(time_ms, 1000)
         m, s = divmod(s, 60)
         h, m = divmod(m, 60)
@@ -428,93 +596,100 @@ def get_time_h_mm_ss_ms(time_ns, mmssms = False):
 def print_result_table(pd, num_res, log_fn):
     logger = setup_logging('result_table', log_fn)
     
-    logger.info('')
-    
-    tname = [pd[i]['name'] for i in range(len(pd))]
+    # The table is collected in rows and logged as a single record.
+    rows = ['']
     
-    # Result table header
-        
     # Get max length of engine names for table formatting.
-    width = len(max(tname, key=len))
+    width = max(len(p['name']) for p in pd.values())
     
+    # Result table header
     tn = '{:>{width}}'.format('name', width=width)
     thead = '{} {:>9s} {:>9s} {:>6s} {:>6s} {:>6s} {:>4s}'.format(
         tn, 'score', 'games', 'score%', 'win%', 'draw%', 'tf')
-    logger.info(thead)
+    rows.append(thead)
 
     # Table data
-    for i in range(len(tname)):
-        w = pd[i]['win']  # num_win
-        l = pd[i]['loss'] # num_loss
-        d = pd[i]['draw'] # num_draw
+    for p in pd.values():
+        w = p['win']  # num_win
+        l = p['loss'] # num_loss
+        d = p['draw'] # num_draw
         g = w + l + d
         s = w + d/2
-        sr = 100*s/g if g > 0 else 0.0
-        wr = 100*w/g if g > 0 else 0.0
-        dr = 100*d/g if g > 0 else 0.0
-        tf = pd[i]['tf']
+        pct = 100/g if g > 0 else 0.0
         
-        tn = '{:>{width}}'.format(tname[i], width=width)
+        tn = '{:>{width}}'.format(p['name'], width=width)
         
-        logger.info('{} {:>9.1f} {:>9d} {:>6.1f} {:>6.1f} {:>6.1f} {:>4d}'.format(
+        rows.append('{} {:>9.1f} {:>9d} {:>6.1f} {:>6.1f} {:>6.1f} {:>4d}'.format(
             tn,
             s,
             g,
-            sr,
-            wr,
-            dr,
-            tf))
+            s*pct,
+            w*pct,
+            d*pct,
+            p['tf']))
         
-    logger.info('')
+    rows.append('')
+    logger.info('\n'.join(rows))
     
 
-def update_score(g, pd):
+def update_score(headers, wp, bp):
     """ 
-    pd: {0: {'name': 'engname', 'engfile': 'a.exe', 'engopt': oa ...}, 1: {...} ...}
+    Update win/loss/draw/tf of the two players of a game in place.
+    
+    headers: pgn headers of the game
+    wp: player data of white, {'name': 'engname', 'win': 0, 'loss': 0, ...}
+    bp: player data of black
     """
-    res = g.headers['Result']
-    wp = g.headers['White']
-    bp = g.headers['Black']
-    termi = g.headers['Termination']
+    res = headers['Result']
+    termi = headers['Termination']
     
     if res == '1-0':
-        for i in range(len(pd)):
-            if wp == pd[i]['name']:
-                pd[i]['win'] += 1
-            if bp == pd[i]['name']:
-                pd[i]['loss'] += 1
-                if termi == 'time forfeit':
-                    pd[i]['tf'] += 1
+        wp['win'] += 1
+        bp['loss'] += 1
+        if termi == 'time forfeit':
+            bp['tf'] += 1
                 
     elif res == '0-1':
-        for i in range(len(pd)):
-            if bp == pd[i]['name']:
-                pd[i]['win'] += 1
-            if wp == pd[i]['name']:
-                pd[i]['loss'] += 1
-                if termi == 'time forfeit':
-                    pd[i]['tf'] += 1                
+        bp['win'] += 1
+        wp['loss'] += 1
+        if termi == 'time forfeit':
+            wp['tf'] += 1
                 
     elif res == '1/2-1/2':
-        for i in range(len(pd)):
-            if wp == pd[i]['name']:
-                pd[i]['draw'] += 1
-            if bp == pd[i]['name']:
-                pd[i]['draw'] += 1
+        wp['draw'] += 1
+        bp['draw'] += 1
+
+
+class OpeningBoardBuilder(chess.pgn.BoardBuilder):
+    def handle_error(self, error):
+        """
+        Log the error and keep the board, like chess.pgn.GameBuilder does,
+        instead of raising it. The board stops at the last legal move.
+        """
+        chess.pgn.LOGGER.exception('error during pgn parsing')
         
-    return pd
+    def result(self):
+        """
+        Return None instead of raising when no board was visited, read_game
+        skips a game whose FEN header is not valid.
+        """
+        return getattr(self, 'board', None)
 
 
 def get_game_list(fn, log_fn, max_round=500, randomize_pos=False):
     """ 
-    Converts fn file into python-chess game objects.
+    Converts fn file into start positions for the games.
+    
+    Only the mainline of pgn games is replayed, no game tree is built. The
+    opening moves are kept on the move stack of each board so that they
+    are still written in the output games.
     
     fn: can be a fen or an epd or a pgn file
-    Return: a list of games
+    Return: a list of python-chess boards
     """
     logger = setup_logging(get_game_list.__name__, log_fn)
     
-    t1 = time.perf_counter_ns()
+    t1 = get_time_ms()
     
     games = []
     
@@ -529,27 +704,31 @@ def get_game_list(fn, log_fn, max_round=500, randomize_pos=False):
     if file_suffix == '.pgn':
         with open(fn) as pgn:
             while True:
-                game = chess.pgn.read_game(pgn)
-                if game is None:
-                    break
-                games.append(game)
+                board = chess.pgn.read_game(pgn, Visitor=OpeningBoardBuilder)
+                if board is None:
+                    # End of file, or a game without a valid start position
+                    # if more games follow.
+                    pos = pgn.tell()
+                    if not pgn.readline():
+                        break
+                    pgn.seek(pos)
+                    logger.warning(f'Skipped a game in {fn_filename}, its start position is not valid.')
+                    continue
+                games.append(board)
                 if len(games) >= max_round:
                     break
     else:
         with open(fn) as pos:
             for lines in pos:
                 line = lines.strip()
-                board = chess.Board(line)
-                game = chess.pgn.Game()
-                game = game.from_board(board)
-                games.append(game)
+                games.append(chess.Board(line))
                 if len(games) >= max_round:
                     break
                 
     if randomize_pos:
         random.shuffle(games)
         
-    elapse = time.perf_counter_ns() - t1
+    elapse = get_time_ms() - t1
     
     if len(games) < max_round:
         logger.info(f'Number of positions in the file {len(games)} are below max_round {max_round}!')
@@ -558,14 +737,15 @@ def get_game_list(fn, log_fn, max_round=500, randomize_pos=False):
     return games
 
 
-def print_match_conditions(max_round, reverse_start_side, opening_file,
-                           randomize_pos, parallel, base_time_ms, inc_time_ms,
-                           adjudication, win_score_cp, win_score_count, log_fn):
+def print_match_conditions(max_round, reverse_start_side, total_games,
+                           opening_file, randomize_pos, parallel, base_time_ms,
+                           inc_time_ms, adjudication, win_score_cp,
+                           win_score_count, log_fn):
     logger = setup_logging('match_conditions', log_fn)
     
     logger.info(f'rounds           : {max_round}')
     logger.info(f'reverse side     : {reverse_start_side}')
-    logger.info(f'total games      : {max_round*2 if reverse_start_side else max_round}')
+    logger.info(f'total games      : {total_games}')
     logger.info(f'opening file     : {opening_file}')
     logger.info(f'randomize fen    : {randomize_pos}')        
     logger.info(f'base time(ms)    : {base_time_ms}')
@@ -576,50 +756,36 @@ def print_match_conditions(max_round, reverse_start_side, opening_file,
     logger.info(f'parallel         : {parallel}\n')
     
     
-def get_engine_data(fn, ename, log_fn):
+def get_engine_data(configs, ename):
     """
-    Read engine json file to get options etc. of ename.
+    Read engine json data to get options etc. of ename.
     
-    fn: engine json file
+    configs: engine configs of the engine json file indexed by name
     ename: engine config name to search
-    return: eng path and file and its options that are not default
+    return: eng path and file and its options that are not default,
+        None if there is no engine config ename
     """
-    logger = setup_logging('engine_data', log_fn)
-    path_file = None
     opt = {}
     
-    with open(fn) as json_file:
-        data = json.load(json_file)
-        
-    for p in data:
-        command = p['command']
-        work_dir = p['workingDirectory']
-        name = p['name']
-        
-        if name != ename:
+    p = configs.get(ename)
+    if p is None:
+        return None
+    
+    command = p['command']
+    work_dir = p['workingDirectory']
+    
+    path_file = Path(work_dir, command).as_posix()
+    
+    for o in p.get('options', []):
+        # d = {'name': 'Ponder', 'default': False, 'value': False, 'type': 'check'}
+        # Options without a default are not set.
+        if 'default' not in o:
             continue
         
-        path_file = Path(work_dir, command).as_posix()
-        
-        for k, v in p.items():
-            if k == 'options':
-                for o in v:
-                    # d = {'name': 'Ponder', 'default': False, 'value': False, 'type': 'check'}
-                    opt_name = o['name']
-                    
-                    try:
-                        opt_default = o['default']
-                    except KeyError:
-                        continue
-                    except Exception:
-                        logger.exception('Error in getting default option value!')
-                        continue
-                        
-                    opt_value = o['value']
-                    if opt_default != opt_value:
-                        opt.update({opt_name: opt_value})
-        
-        return path_file, opt
+        if o['default'] != o['value']:
+            opt[o['name']] = o['value']
+    
+    return path_file, opt
     
 
 def get_match_data(engine_option_value, match_fn, rounds, reverse, parallel,
@@ -636,17 +802,14 @@ def get_match_data(engine_option_value, match_fn, rounds, reverse, parallel,
         for i, e in enumerate(engine_option_value):
             name, base_time_ms, inc_time_ms = None, None, None
             for v in e:
-                par_name = v.split('=')[0]
-                par_value = v.split('=')[1]
+                par_name, _, par_value = v.partition('=')
                 if par_name == 'config-name':
                     name = par_value
                 elif par_name == 'tc':
-                    tc_val = par_value
-                    base_time_ms = int(tc_val.split('+')[0])
-                    try:
-                        inc_time_ms = int(tc_val.split('+')[1])
-                    except IndexError:
+                    base_val, sep, inc_val = par_value.partition('+')
+                    if not sep:
                         raise Exception('Time increment is missing!')
+                    base_time_ms, inc_time_ms = int(base_val), int(inc_val)
                     
             names.append(name)
             d = {i: {'name': name, 'base': base_time_ms, 'inc': inc_time_ms}}
@@ -658,58 +821,58 @@ def get_match_data(engine_option_value, match_fn, rounds, reverse, parallel,
         if opt_win_adjudication:
             win_adj = True
             for v in opt_win_adjudication:
-                value = v.split('=')
-                if value[0] == 'score':
-                    win_score_cp = int(value[1])
-                elif value[0] == 'count':
-                    win_score_count = int(value[1])
+                par_name, _, par_value = v.partition('=')
+                if par_name == 'score':
+                    win_score_cp = int(par_value)
+                elif par_name == 'count':
+                    win_score_count = int(par_value)
                 
     else:
         # Read match.ini to determine the player names, etc
         parser = configparser.ConfigParser()
         parser.read(match_fn)
         for section_name in parser.sections():
-            for name, value in parser.items(section_name):
+            for key, value in parser.items(section_name):
                 if section_name.lower() == 'combat':
-                    if name == 'engine config file':
+                    if key == 'engine config file':
                         engine_json = value
-                    elif name == 'round':
+                    elif key == 'round':
                         rounds = int(value)
-                    elif name == 'opening file':
+                    elif key == 'opening file':
                         op_file = value
-                    elif name == 'reverse':
+                    elif key == 'reverse':
                         reverse = value
-                    elif name == 'randomize position':
+                    elif key == 'randomize position':
                         random_pos = value
-                    elif name == 'parallel':
+                    elif key == 'parallel':
                         parallel = int(value)                        
-                    elif name == 'win adjudication enable':
+                    elif key == 'win adjudication enable':
                         win_adj = value
-                    elif name == 'win adjudication score':
+                    elif key == 'win adjudication score':
                         win_score_cp = int(value)
-                    elif name == 'win adjudication count':
+                    elif key == 'win adjudication count':
                         win_score_count = int(value)
-                    elif name == 'engine logging':
+                    elif key == 'engine logging':
                         is_engine_log = True if value == 'true' else False
                         
                 elif section_name.lower() == 'engine1':
-                    if name == 'name':
+                    if key == 'name':
                         name = value
                         names.append(name)
-                    elif name.lower() == 'tc':
-                        base_time_ms = int(value.split('+')[0])
-                        inc_time_ms = int(value.split('+')[1])
+                    elif key.lower() == 'tc':
+                        base_val, _, inc_val = value.partition('+')
+                        base_time_ms, inc_time_ms = int(base_val), int(inc_val)
                         
                     d = {0: {'name': name, 'base': base_time_ms, 'inc': inc_time_ms}}
                     players.update(d)
                     
                 elif section_name.lower() == 'engine2':
-                    if name.lower() == 'name':
+                    if key.lower() == 'name':
                         name = value
                         names.append(name)
-                    elif name.lower() == 'tc':
-                        base_time_ms = int(value.split('+')[0])
-                        inc_time_ms = int(value.split('+')[1])
+                    elif key.lower() == 'tc':
+                        base_val, _, inc_val = value.partition('+')
+                        base_time_ms, inc_time_ms = int(base_val), int(inc_val)
                         
                     d = {1: {'name': name, 'base': base_time_ms, 'inc': inc_time_ms}}
                     players.update(d)
@@ -721,23 +884,21 @@ def get_match_data(engine_option_value, match_fn, rounds, reverse, parallel,
 
 def delete_file(*fns):
     """
-    Delete tuple elements in fns.
+    Delete tuple elements in fns, files that do not exist are skipped.
     """
     for fn in fns:        
-        try:
+        with contextlib.suppress(FileNotFoundError):
             os.remove(fn)
-        except OSError:
-            pass
         
 
 def get_opening_data(opt_value):
     opening_file, randomize_pos = None, False
     for v in opt_value:
-        value = v.split('=')
-        if value[0] == 'file':
-            opening_file = value[1]
-        elif value[0] == 'random':
-            randomize_pos = True if value[1] == 'true' else False
+        par_name, _, par_value = v.partition('=')
+        if par_name == 'file':
+            opening_file = par_value
+        elif par_name == 'random':
+            randomize_pos = True if par_value == 'true' else False
             
     return opening_file, randomize_pos
 
@@ -752,32 +913,143 @@ def error_check(players, names):
         if None in [players[i]['base'], players[i]['inc']]:
             raise Exception(f'{"Black" if i == 0 else "White"} TC was not defined! Use tc=base_time_ms+inc_time_ms')
 
-def get_engine_file_and_option(engine_json, names, log_fn):
+def get_engine_file_and_option(engine_json, names):
     """
     Return engine file and its option in engine json file.
     """    
-    eng_files, eng_opts = [None] * len(names), [None] * len(names)
-    for i in range(len(names)):
+    # Read the engine json file once for all engines and index the engine
+    # configs by name, the first config of a name is used.
+    configs = {}
+    try:
+        with open(engine_json) as json_file:
+            data = json.load(json_file)
+        
+        for p in data:
+            configs.setdefault(p['name'], p)
+    except Exception:
+        raise Exception(f'Exception occurs in getting engine data from {Path(engine_json).name}')
+    
+    eng_files, eng_opts = [], []
+    for name in names:
         try:
-            eng_files[i], eng_opts[i] = get_engine_data(engine_json, names[i], log_fn)
+            eng_file, eng_opt = get_engine_data(configs, name)
         except TypeError:
-            raise Exception(f'engine {names[i]} cannot be found in {Path(engine_json).name}!')
+            raise Exception(f'engine {name} cannot be found in {Path(engine_json).name}!')
         except Exception:
             raise Exception(f'Exception occurs in getting engine data from {Path(engine_json).name}')
+        
+        eng_files.append(eng_file)
+        eng_opts.append(eng_opt)
             
     return eng_files, eng_opts
 
 
 def get_clock(players):
     """
-    Create clock for each engine and return it.
+    Create clock for each player and return them by player index, players
+    with the same engine name can have different time controls.
     """    
-    clock = []
-    for _, v in players.items():
-        clock.append(Timer(v['base'], v['inc']))
+    clock = [Timer(v['base'], v['inc']) for v in players.values()]
         
     return clock
 
+
+def get_player_pairs(num_players, reverse_start_side, gauntlet_color):
+    """
+    Returns the (player1, player2) indexes of the games of every round,
+    engine 1 is the gauntlet. Both sides are played when reverse_start_side
+    is set and there is no gauntlet color.
+    """
+    pairs = []
+    for i in range(1, num_players):
+        m, n = 0, i
+        
+        if gauntlet_color == 'white':
+            m, n = n, m
+            
+        pairs.append((m, n))
+        
+        if reverse_start_side and gauntlet_color not in ('white', 'black'):
+            pairs.append((n, m))  # Reverse the side
+            
+    return pairs
+
+
+def get_match_chunks(num_games, pairs, reverse_start_side, chunk_size):
+    """
+    Generates the games to be played as lists of chunk_size run_matches()
+    jobs, each list is played by one worker. Jobs are only created when the
+    next list is needed.
+    
+    pairs: players of the games of every round from get_player_pairs()
+    """
+    game_id = 0
+    matches = []
+    
+    for round_num in range(1, num_games + 1):
+        for sub_round, (m, n) in enumerate(pairs, 1):
+            game_id += 1
+            
+            # Round is round.sub_round, e.g. 1.2 for the second game of round
+            # 1, written as text to not get float rounding errors.
+            matches.append(
+                (round_num - 1, m, n,
+                 f'{round_num}.{sub_round}' if reverse_start_side else round_num,
+                 game_id))
+            
+            if len(matches) >= chunk_size:
+                yield matches
+                matches = []
+                
+    if matches:
+        yield matches
+
+
+def save_results(results, pgn_file, player_data, num_res, table_interval,
+                 logger, log_fn):
+    """
+    Saves the games of run_matches() results to the output pgn file,
+    updates the scores and logs the game results.
+    
+    pgn_file: the output pgn file
+    num_res: number of game results before these results
+    return: number of game results including these results
+    """
+    for pgn, headers, game_num, round_number, game_elapse, white_index, \
+            black_index in results:
+        try:
+            num_res += 1
+        
+            wp = headers['White']
+            bp = headers['Black']
+            res = headers['Result']
+            termi = headers.get('Termination', 'normal')
+        
+            # Save games to a file, flushed every few games
+            pgn_file.write(pgn)
+            pgn_file.write('\n\n')
+            if num_res % 32 == 0:
+                pgn_file.flush()
+        
+            # Update engine score incrementally for result table, players
+            # with the same engine name are counted apart.
+            update_score(headers, player_data[white_index],
+                         player_data[black_index])
+
+            # Only format the game info if it is logged.
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f'Done, game: {game_num}, round: {round_number}, elapse: {get_time_h_mm_ss_ms(game_elapse)}')
+                logger.info(f'players: {wp} vs {bp}')
+                logger.info(f'result: {res} ({termi})')
+        
+            if num_res % table_interval == 0:
+                print_result_table(player_data, num_res, log_fn)
+
+        except Exception:
+            logger.exception('Exception in completed analysis.')
+            
+    return num_res
+
     
 def main():    
     parser = argparse.ArgumentParser(
@@ -892,116 +1164,108 @@ def main():
     error_check(players, names)
 
     # Get eng file and options from engine json file
-    eng_files, eng_opts = get_engine_file_and_option(engine_json, names, log_fn)
+    eng_files, eng_opts = get_engine_file_and_option(engine_json, names)
     
     # Save overall player_data in a dict
-    player_data = {}
-    for i, (n, f, o, c) in enumerate(zip(names, eng_files, eng_opts, clock)):
-        d = {i: {'name': n, 'file': f, 'opt': o,
-                 'clock': c, 'win': 0, 'loss': 0, 'draw': 0, 'tf': 0}}
-        player_data.update(d)
+    player_data = {
+        i: {'index': i, 'name': n, 'file': f, 'opt': o,
+            'clock': clock[i], 'win': 0, 'loss': 0, 'draw': 0, 'tf': 0}
+        for i, (n, f, o) in enumerate(zip(names, eng_files, eng_opts))}
 
-    analysis, round_num, num_res = [], 0, 0
+    num_res = 0
     
     # Record elapse time for the whole match
-    time_start = time.perf_counter_ns()
+    time_start = get_time_ms()
     
     # Prepare opening start positions for the match
     games = get_game_list(opening_file, log_fn, max_round, randomize_pos)
 
-    total_games = (len(player_data)-1) * len(games) * 2 if reverse_start_side else (len(player_data)-1) * len(games)
-    total_games = total_games if gauntlet_color is None else total_games//2
+    # Players of the games of every round, and the number of games
+    pairs = get_player_pairs(len(player_data), reverse_start_side,
+                             gauntlet_color)
+    total_games = len(pairs) * len(games)
+    
+    print_match_conditions(len(games), reverse_start_side, total_games,
+                           opening_file, randomize_pos, parallel, base_time_ms,
+                           inc_time_ms, win_adj, win_score_cp, win_score_count,
+                           log_fn)
     
-    print_match_conditions(len(games), reverse_start_side, opening_file,
-                           randomize_pos, parallel, base_time_ms, inc_time_ms,
-                           win_adj, win_score_cp, win_score_count, log_fn)
+    # Print the result table about 100 times in the whole match.
+    table_interval = max(1, total_games // 100)
     
     # Run game matches in parallel
     if parallel < 1:
         logger.warning(f'parallel is only {parallel}!, now it set at 1.')
         parallel = 1
 
-    with ProcessPoolExecutor(max_workers=parallel) as executor:
-        game_id, round_num = 0, 0
-        
-        # Submit engine matches as job
-        for game in games:                    
-            round_num += 1
-            sub_round = 0.0
+    # Submit engine matches as jobs of chunk_size games each, played by
+    # one worker. A chunk is at most the games of one round, and small
+    # enough to give every worker several jobs.
+    chunk_size = max(1, min(len(pairs), total_games // (4 * parallel)))
+    chunks = get_match_chunks(len(games), pairs, reverse_start_side,
+                              chunk_size)
+    
+    # The output pgn file is kept open for the whole match.
+    with open(outpgn, 'a') as pgn_file:
+        if parallel == 1:
+            # Play the games in this process, without a worker process
+            # there is nothing to pickle.
+            init_worker(games, player_data, total_games, log_fn, win_adj,
+                        win_score_cp, win_score_count, is_engine_log)
             
-            # Generate gauntlet matches, engine 1 is the gauntlet.
-            for i in range(len(player_data)):
-                m, n = 0, i+1
+            for matches in chunks:
+                num_res = save_results(
+                    run_matches(matches), pgn_file, player_data, num_res,
+                    table_interval, logger, log_fn)
                 
-                if gauntlet_color == 'white':
-                    m, n = n, m
+            quit_engines()
                 
-                if i == len(player_data) - 1:
-                    break
-                
-                games_per_pair_per_round = 0
-                while True:
-                    game_id += 1
-                    sub_round += 0.1
-                    
-                    g = Match(
-                        game,
-                        player_data[m],
-                        player_data[n],
-                        round_num + sub_round if reverse_start_side else round_num,
-                        total_games, game_id, log_fn,
-                        win_adj, win_score_cp, win_score_count, is_engine_log)
+        else:
+            # Fork the workers on Linux, they inherit the imported modules
+            # and the settings of the match instead of starting a new
+            # interpreter.
+            mp_context = None
+            if sys.platform.startswith('linux'):
+                mp_context = multiprocessing.get_context('fork')
+            
+            # The settings of the match and the start positions are sent
+            # once to every worker, the jobs only refer to them by index.
+            with ProcessPoolExecutor(
+                    max_workers=parallel, mp_context=mp_context,
+                    initializer=init_worker,
+                    initargs=(games, player_data, total_games, log_fn,
+                              win_adj, win_score_cp, win_score_count,
+                              is_engine_log)) as executor:
+                # Only keep a few jobs per worker submitted, the next job
+                # is submitted when one is done.
+                pending = set()
+                for matches in itertools.islice(chunks, 4 * parallel):
+                    pending.add(executor.submit(run_matches, matches))
                     
-                    job = executor.submit(g.start_match)
-                    analysis.append(job)
-                    games_per_pair_per_round += 1
+                # Process every game results
+                while pending:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
                     
-                    if not reverse_start_side or \
-                        gauntlet_color == 'white' or gauntlet_color == 'black':
-                        break
+                    for matches in itertools.islice(chunks, len(done)):
+                        pending.add(executor.submit(run_matches, matches))
                     
-                    if games_per_pair_per_round >= 2:
-                        break
-                    
-                    m, n = n, m  # Reverse the side
-            
-        # Process every game results
-        for future in concurrent.futures.as_completed(analysis):
-            try:
-                game_output = future.result()[0]
-                game_num = future.result()[1]
-                round_number = future.result()[2]
-                game_elapse = future.result()[3]  # nanoseconds
-                
-                num_res += 1
-                
-                wp = game_output.headers['White']
-                bp = game_output.headers['Black']
-                res = game_output.headers['Result']
-                try:
-                    termi = game_output.headers['Termination']
-                except KeyError:
-                    termi = 'normal'
-                except Exception:
-                    logger.exception('Error in getting termination header value!')
-                    termi = 'unknown'
-                
-                # Save games to a file
-                print(game_output, file=open(outpgn, 'a'), end='\n\n')
-                
-                # Update engine score incrementally for result table
-                player_data = update_score(game_output, player_data)
-
-                logger.info(f'Done, game: {game_num}, round: {round_number}, elapse: {get_time_h_mm_ss_ms(game_elapse)}')
-                logger.info(f'players: {wp} vs {bp}')
-                logger.info(f'result: {res} ({termi})')
-                
-                print_result_table(player_data, num_res, log_fn)
-
-            except Exception:
-                logger.exception('Exception in completed analysis.')         
+                    for future in done:
+                        try:
+                            results = future.result()
+                        except Exception:
+                            logger.exception('Exception in completed analysis.')
+                            continue
+                        
+                        num_res = save_results(
+                            results, pgn_file, player_data, num_res,
+                            table_interval, logger, log_fn)
+    
+    # Print the final result table if it was not printed after the last game
+    if num_res % table_interval:
+        print_result_table(player_data, num_res, log_fn)
     
-    elapse = time.perf_counter_ns() - time_start  # time delta in nanoseconds
+    elapse = get_time_ms() - time_start  # time delta in ms
     logger.info(f'Match: done, elapse: {get_time_h_mm_ss_ms(elapse)}')
     
     logging.shutdown()